@@ -29,7 +29,7 @@ interface AnalysisResult {
     areasForCaution: number;
   };
   clauses: Clause[];
-  documentText: string;
+  documentText?: string;
   error?: string;
 }
 
@@ -224,7 +224,7 @@ export default function LabourContractAnalysis() {
       setIsLoading(false);
     },
     onError: (error: Error) => {
-      setAnalysisResult({ error: error.message, summary: { criticalIssues: 0, areasForCaution: 0 }, clauses: [], documentText: "" });
+      setAnalysisResult({ error: error.message, summary: { criticalIssues: 0, areasForCaution: 0 }, clauses: [] });
       setIsLoading(false);
     },
   });
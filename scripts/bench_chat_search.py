@@ -0,0 +1,134 @@
+"""
+Benchmarks chat history search: FTS5 (search_chat_messages) vs a LIKE scan.
+
+    python scripts/bench_chat_search.py --messages 1000000
+
+Builds a throwaway SQLite database with the chat schema, fills it with
+synthetic messages, times the FTS backfill migration and then each query.
+"""
+import sys
+import os
+import argparse
+import random
+import tempfile
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from server.storage import Base, migrate_chat_fts, search_chat_messages
+
+TOPIC_WORDS = (
+    "employment act salary overtime annual leave sick maternity termination notice "
+    "probation contract employer employee wages epf socso contribution dismissal "
+    "retrenchment benefits working hours rest day public holiday industrial court "
+    "union collective agreement safety accident compensation claim gaji cuti kerja "
+    "majikan pekerja notis penamatan kontrak"
+).split()
+
+QUERIES = ["overtime", "annual leave", "retrenchment benefits", "notis penamatan", "socso claim", "matern", "w4242"]
+
+# Filler vocabulary with a Zipf-like frequency distribution, so term
+# frequencies look like natural text rather than a handful of words that
+# appear in every message.
+FILLER_SIZE = 50000
+
+
+def message_generator(rng: random.Random):
+    filler = [f"w{i}" for i in range(FILLER_SIZE)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, FILLER_SIZE + 1):
+        total += 1.0 / rank
+        cum_weights.append(total)
+
+    def generate():
+        words = rng.choices(filler, cum_weights=cum_weights, k=rng.randint(8, 60))
+        for _ in range(rng.randint(0, 2)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(TOPIC_WORDS))
+        return " ".join(words)
+
+    return generate
+
+
+def build_database(path: str, messages: int, sessions: int, seed: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    generate = message_generator(rng)
+    batch = 50000
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        conn.execute(
+            text('INSERT INTO chat_sessions (id, title, "createdAt") VALUES (:id, :title, :createdAt)'),
+            [{"id": f"session-{i}", "title": f"Session {i}", "createdAt": "2025-01-01T00:00:00"} for i in range(sessions)],
+        )
+        for start in range(0, messages, batch):
+            rows = [
+                {
+                    "sessionId": f"session-{rng.randrange(sessions)}",
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": generate(),
+                    "createdAt": "2025-01-01T00:00:00",
+                }
+                for i in range(start, min(start + batch, messages))
+            ]
+            conn.execute(
+                text('INSERT INTO chat_messages ("sessionId", role, content, "createdAt") VALUES (:sessionId, :role, :content, :createdAt)'),
+                rows,
+            )
+    return engine
+
+
+def timed(func, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench_chat.db")
+
+        start = time.perf_counter()
+        engine = build_database(path, args.messages, args.sessions, args.seed)
+        print(f"Inserted {args.messages:,} messages in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        migrate_chat_fts(engine)
+        print(f"FTS backfill migration took {time.perf_counter() - start:.1f}s")
+
+        db = sessionmaker(bind=engine)()
+        print(f"\n{'query':<24}{'fts ms':>10}{'session ms':>14}{'like ms':>10}{'like rows':>10}")
+        for query in QUERIES:
+            fts_ms, _ = timed(lambda: search_chat_messages(db, query, limit=20), args.repeat)
+            session_ms, _ = timed(lambda: search_chat_messages(db, query, session_ids=["session-1"], limit=20), args.repeat)
+            like_ms, like_rows = timed(
+                lambda: db.execute(
+                    text("SELECT id FROM chat_messages WHERE content LIKE :pattern"),
+                    {"pattern": f"%{query}%"},
+                ).all(),
+                args.repeat,
+            )
+            print(f"{query:<24}{fts_ms:>10.2f}{session_ms:>14.2f}{like_ms:>10.2f}{len(like_rows):>10}")
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
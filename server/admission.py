@@ -0,0 +1,302 @@
+import asyncio
+import ipaddress
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+
+from server.responses import ORJSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+class RouteLimit:
+    """
+    Admission settings for one expensive route (or route prefix).
+    Overridable with ADMISSION_<NAME>="concurrency,queue,max_wait_seconds".
+    """
+
+    def __init__(self, name: str, path: str, concurrency: int, queue: int, max_wait: float, prefix: bool = False):
+        override = os.getenv(f"ADMISSION_{name.upper()}")
+        if override:
+            concurrency, queue, max_wait = override.split(",")
+        self.name = name
+        self.path = path
+        self.prefix = prefix
+        self.concurrency = int(concurrency)
+        self.queue = int(queue)
+        self.max_wait = float(max_wait)
+        # A single client may hold at most this many running + queued requests,
+        # so one user's burst cannot take the whole route
+        self.per_client = max(1, int(os.getenv("ADMISSION_PER_CLIENT_SHARE", "50")) * (self.concurrency + self.queue) // 100)
+
+    def matches(self, path: str) -> bool:
+        return path.startswith(self.path) if self.prefix else path == self.path
+
+
+# Thread budget per worker:
+# - The sum of concurrency caps (28) stays below the request threadpool size
+#   (40), so chat always has worker threads left while contract analyses run.
+# - Chat's Bedrock and translation calls run on separate stage pools in
+#   server/services/model.py: MODEL_STAGE_WORKERS (48, 3x the chat cap) for
+#   KB/model calls and SHORT_STAGE_WORKERS (32, 2x) for detect/translate.
+#   Raise them along with ADMISSION_CHAT.
+ROUTE_LIMITS = [
+    RouteLimit("upload", "/api/upload", concurrency=4, queue=8, max_wait=10),
+    RouteLimit("analyze", "/api/analyze-labour-contract", concurrency=4, queue=8, max_wait=10, prefix=True),
+    RouteLimit("transcribe", "/api/transcribe", concurrency=4, queue=8, max_wait=10),
+    RouteLimit("chat", "/api/chat/message", concurrency=16, queue=64, max_wait=15),
+]
+
+# Number of recent queue times kept per route for percentiles
+QUEUE_SAMPLES = 1000
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str):
+        self.status_code = status_code
+        self.reason = reason
+
+
+class RouteAdmission:
+    """
+    Concurrency cap with a bounded wait queue. Freed slots are handed to waiting
+    clients round-robin rather than first-come, so a client that queued ten
+    uploads does not starve one that queued a single upload.
+    """
+
+    def __init__(self, limit: RouteLimit):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self._waiters = OrderedDict()  # client -> deque of futures
+        self._per_client = {}  # client -> running + queued
+        self._queue_times = deque(maxlen=QUEUE_SAMPLES)
+        self._service_time = 1.0  # EWMA of seconds per request, for Retry-After
+        self.admitted = 0
+        self.rejected = {429: 0, 503: 0}
+
+    async def acquire(self, client: str) -> float:
+        """
+        Waits for a slot and returns the time spent queued, or raises Rejected.
+        """
+        if self._per_client.get(client, 0) >= self.limit.per_client:
+            raise self._reject(429, "Too many concurrent requests from this client")
+
+        start = time.monotonic()
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        if self.active < self.limit.concurrency and not self.queued:
+            self.active += 1
+        else:
+            if self.queued >= self.limit.queue:
+                self._forget_client(client)
+                raise self._reject(503, "Server is busy")
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(client, deque()).append(future)
+            self.queued += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.limit.max_wait)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as we gave up; pass it on
+                    self._release_slot()
+                else:
+                    future.cancel()
+                    self._remove_waiter(client, future)
+                self._forget_client(client)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise self._reject(503, "Timed out waiting for capacity")
+
+        self.admitted += 1
+        waited = time.monotonic() - start
+        self._queue_times.append(waited)
+        return waited
+
+    def release(self, client: str, service_time: float):
+        self._service_time = 0.9 * self._service_time + 0.1 * service_time
+        self._forget_client(client)
+        self._release_slot()
+
+    def _forget_client(self, client: str):
+        count = self._per_client.get(client, 1) - 1
+        if count > 0:
+            self._per_client[client] = count
+        else:
+            self._per_client.pop(client, None)
+
+    def _release_slot(self):
+        # Hand the slot straight to the next client in round-robin order
+        while self._waiters:
+            client, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                self._waiters.move_to_end(client)
+            else:
+                del self._waiters[client]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _remove_waiter(self, client: str, future):
+        waiters = self._waiters.get(client)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self.queued -= 1
+            if not waiters:
+                del self._waiters[client]
+
+    def _reject(self, status_code: int, reason: str):
+        self.rejected[status_code] += 1
+        return Rejected(status_code, reason)
+
+    def retry_after(self) -> int:
+        # Rough time for the current queue to drain
+        backlog = (self.queued + 1) / max(1, self.limit.concurrency)
+        return max(1, round(backlog * self._service_time))
+
+    def stats(self):
+        samples = sorted(self._queue_times)
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "concurrency": self.limit.concurrency,
+            "queueLimit": self.limit.queue,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected429": self.rejected[429],
+            "rejected503": self.rejected[503],
+            "queueTimeMs": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99), "max": percentile(1.0)},
+            "serviceTimeMs": round(self._service_time * 1000, 2),
+        }
+
+
+def _parse_trusted_proxies(value: str):
+    """
+    ADMISSION_TRUSTED_PROXIES is either the number of proxies in front of the
+    server ("1" behind a single load balancer) or a comma-separated list of
+    proxy addresses/CIDRs. Returns (hop_count, networks).
+    """
+    value = value.strip()
+    if not value:
+        return 0, []
+    if value.isdigit():
+        return int(value), []
+    return 0, [ipaddress.ip_network(entry.strip(), strict=False) for entry in value.split(",") if entry.strip()]
+
+
+# X-Forwarded-For is client-controlled, so it is only read when the proxies
+# that append to it are configured; otherwise the socket peer is the client
+TRUSTED_PROXY_HOPS, TRUSTED_PROXY_NETWORKS = _parse_trusted_proxies(os.getenv("ADMISSION_TRUSTED_PROXIES", ""))
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXY_NETWORKS)
+
+
+def client_id(scope) -> str:
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if not TRUSTED_PROXY_HOPS and not TRUSTED_PROXY_NETWORKS:
+        return peer
+
+    forwarded = []
+    for name, value in scope.get("headers", []):
+        if name == b"x-forwarded-for":
+            forwarded.extend(entry.strip() for entry in value.decode("latin-1").split(","))
+    forwarded = [entry for entry in forwarded if entry]
+
+    if TRUSTED_PROXY_HOPS:
+        # Each trusted proxy appends the address it received the request from,
+        # so the client is the entry the outermost proxy added; anything to its
+        # left was sent by the client
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+        return peer
+
+    if not _is_trusted_proxy(peer):
+        return peer
+    # Right-most address that is not one of our proxies
+    for entry in reversed(forwarded):
+        if not _is_trusted_proxy(entry):
+            return entry
+    return forwarded[0] if forwarded else peer
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware enforcing ROUTE_LIMITS on POST requests. Requests over
+    capacity get a fast 429 (client over its share) or 503 (route saturated)
+    with Retry-After. Admitted responses carry their queue time in a
+    Server-Timing header.
+    """
+
+    def __init__(self, app, limits=ROUTE_LIMITS):
+        self.app = app
+        self.routes = [RouteAdmission(limit) for limit in limits]
+
+    def _route_for(self, scope):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return None
+        for route in self.routes:
+            if route.limit.matches(scope["path"]):
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        route = self._route_for(scope)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_id(scope)
+        try:
+            waited = await route.acquire(client)
+        except Rejected as e:
+            logger.warning(f"Rejected {scope['path']} from {client} with {e.status_code}: {e.reason}")
+            response = ORJSONResponse(
+                {"detail": e.reason},
+                status_code=e.status_code,
+                headers={"Retry-After": str(route.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", f"queue;dur={waited * 1000:.1f}".encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route.release(client, time.monotonic() - start)
+
+    def stats(self):
+        return {route.limit.name: route.stats() for route in self.routes}
+
+
+def get_admission_stats(app):
+    """
+    Finds the AdmissionControlMiddleware instance in the built middleware stack.
+    """
+    node = app.middleware_stack
+    while node is not None:
+        if isinstance(node, AdmissionControlMiddleware):
+            return node.stats()
+        node = getattr(node, "app", None)
+    return {}
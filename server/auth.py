@@ -2,8 +2,14 @@
 from fastapi import Depends, HTTPException, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt
+import os
+import logging
 import requests
 
+from server.cache import get_cache
+
+logger = logging.getLogger(__name__)
+
 # Replace with your Cognito details
 COGNITO_REGION = "ap-southeast-1"
 USERPOOL_ID = "aus-east-1_pE26qmN2e"
@@ -12,14 +18,64 @@ APP_CLIENT_ID = "3kf9v98lsnrv4m874lkct4qep7"
 # Cognito JWKs URL
 JWKS_URL = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USERPOOL_ID}/.well-known/jwks.json"
 
-# Cache JWKs
-jwks = requests.get(JWKS_URL).json()
+# Cache JWKs in the shared cache so every worker reuses one fetch
+JWKS_TTL = int(os.getenv("JWKS_TTL", "3600"))
+# Minimum seconds between forced refetches triggered by an unknown kid, shared
+# by all workers, so tokens with made-up kids cannot make us hammer Cognito
+JWKS_REFRESH_INTERVAL = int(os.getenv("JWKS_REFRESH_INTERVAL", "60"))
+jwks_cache = get_cache("jwks", ttl=JWKS_TTL)
 bearer_scheme = HTTPBearer()
+# For routes where a token is only needed for some requests
+optional_bearer_scheme = HTTPBearer(auto_error=False)
+
+# Cognito group whose members may use support-only features such as
+# searching across every user's chat sessions
+SUPPORT_GROUP = os.getenv("SUPPORT_GROUP", "support")
+
+# Cognito group whose members may use operator endpoints (cache stats,
+# diagnostics). End users of the app are not in it.
+OPS_GROUP = os.getenv("OPS_GROUP", "ops")
+
+def is_support(payload: dict) -> bool:
+    return SUPPORT_GROUP in payload.get("cognito:groups", [])
+
+def fetch_jwks():
+    """
+    Fetches the JWKs from Cognito and caches them. Only a payload with a keys
+    list is cached. On error, returns None and blocks further fetches for
+    JWKS_REFRESH_INTERVAL.
+    """
+    try:
+        response = requests.get(JWKS_URL, timeout=5)
+        response.raise_for_status()
+        jwks = response.json()
+        if not isinstance(jwks, dict) or not isinstance(jwks.get("keys"), list):
+            raise ValueError("response has no keys list")
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"Failed to fetch JWKs: {e}")
+        jwks_cache.set("fetch_failed", True, ttl=JWKS_REFRESH_INTERVAL)
+        return None
+    jwks_cache.set(JWKS_URL, jwks)
+    return jwks
+
+def get_jwks(refresh: bool = False):
+    jwks = jwks_cache.get(JWKS_URL)
+    if jwks is None:
+        if jwks_cache.get("fetch_failed") is None:
+            jwks = fetch_jwks()
+    elif refresh and jwks_cache.get("refreshed") is None:
+        # Rate-limit forced refreshes; the marker expires after the interval
+        jwks_cache.set("refreshed", True, ttl=JWKS_REFRESH_INTERVAL)
+        # Keep serving the cached keys if the refetch fails
+        jwks = fetch_jwks() or jwks
+    return jwks or {"keys": []}
 
 def get_public_key(kid: str):
-    for key in jwks["keys"]:
-        if key["kid"] == kid:
-            return key
+    for refresh in (False, True):
+        # An unknown kid may mean Cognito rotated its keys; refetch once
+        for key in get_jwks(refresh)["keys"]:
+            if key.get("kid") == kid:
+                return key
     return None
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Security(bearer_scheme)):
@@ -40,3 +96,8 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(bearer_sch
         return payload
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
+
+def verify_operator(payload: dict = Depends(verify_token)):
+    if OPS_GROUP not in payload.get("cognito:groups", []):
+        raise HTTPException(status_code=403, detail="Requires the operator role")
+    return payload
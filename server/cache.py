@@ -0,0 +1,348 @@
+"""
+Cache shared by all uvicorn workers on a host.
+
+Two tiers:
+  - an in-process LRU (fast, per worker, short TTL so it cannot drift far from L2)
+  - a shared tier: SQLite file (default), Redis when CACHE_BACKEND=redis, or
+    none when CACHE_BACKEND=memory
+
+Values must be JSON-serializable. Use get_cache(namespace) to get a cache for
+one kind of result, e.g. get_cache("translations", ttl=86400).
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict, defaultdict
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_PATH = os.getenv("CACHE_PATH", "./cache.db")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_MEMORY_SIZE = int(os.getenv("CACHE_MEMORY_SIZE", "2048"))
+CACHE_MEMORY_TTL = float(os.getenv("CACHE_MEMORY_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+CACHE_MAX_VALUE_BYTES = int(os.getenv("CACHE_MAX_VALUE_BYTES", str(1024 * 1024)))
+
+
+class MemoryBackend:
+    """
+    In-process LRU with per-entry expiry.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_SIZE):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            item = self._items.get((namespace, key))
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._items[(namespace, key)]
+                return None
+            self._items.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._items[(namespace, key)] = (value, expires_at)
+            self._items.move_to_end((namespace, key))
+            evicted = 0
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._items.pop((namespace, key), None)
+
+    def count(self, namespace: str = None):
+        with self._lock:
+            if namespace is None:
+                return len(self._items)
+            return sum(1 for ns, _ in self._items if ns == namespace)
+
+
+class SQLiteBackend:
+    """
+    Shared tier in a local SQLite file (WAL mode), so every worker process on
+    the host reads and writes the same entries. Like every shared backend, get
+    returns (value, expires_at) so the in-process tier never outlives an entry.
+    """
+
+    # Eviction is checked every this many writes rather than on each one
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " expires_at REAL,"
+                " stored_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_stored_at ON cache (stored_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(namespace, key)
+            return None
+        return value, expires_at
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float = None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, value, expires_at, now),
+            )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            return self.evict()
+        return 0
+
+    def delete(self, namespace: str, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def evict(self):
+        """
+        Drops expired entries, then the oldest ones above max_entries.
+        """
+        with self._connect() as conn:
+            evicted = conn.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            ).rowcount
+            excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted += conn.execute(
+                    "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY stored_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        return evicted
+
+    def count(self, namespace: str = None):
+        if namespace is None:
+            return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (namespace,)
+        ).fetchone()[0]
+
+
+class RedisBackend:
+    """
+    Shared tier on a Redis-compatible server (requires the `redis` package).
+    Size is bounded by the server's maxmemory policy.
+    """
+
+    def __init__(self, url: str = CACHE_URL):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, namespace: str, key: str):
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.get(f"{namespace}:{key}")
+        pipeline.pttl(f"{namespace}:{key}")
+        value, ttl_ms = pipeline.execute()
+        if value is None:
+            return None
+        # PTTL is -1 for keys without expiry
+        return value, time.time() + ttl_ms / 1000 if ttl_ms >= 0 else None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float = None):
+        self._client.set(f"{namespace}:{key}", value, px=int(ttl * 1000) if ttl else None)
+        return 0
+
+    def delete(self, namespace: str, key: str):
+        self._client.delete(f"{namespace}:{key}")
+
+    def count(self, namespace: str):
+        """
+        Counts one namespace's keys. SCAN walks the whole keyspace, so this is
+        for the stats endpoint only; there is no database-wide count, as the
+        database may hold keys that are not ours.
+        """
+        return sum(1 for _ in self._client.scan_iter(match=f"{namespace}:*", count=1000))
+
+
+def _create_shared_backend():
+    if CACHE_BACKEND == "memory":
+        return None
+    try:
+        if CACHE_BACKEND == "redis":
+            return RedisBackend()
+        return SQLiteBackend()
+    except Exception as e:
+        logger.error(f"Failed to initialize '{CACHE_BACKEND}' cache backend: {e}. Using in-process cache only.")
+        return None
+
+
+class TieredCache:
+    """
+    In-process LRU in front of an optional shared backend. Errors from the
+    shared tier are logged and treated as misses so caching never fails a request.
+    """
+
+    def __init__(self, memory: MemoryBackend, shared=None):
+        self.memory = memory
+        self.shared = shared
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._stats_lock = threading.Lock()
+
+    def _count(self, namespace: str, stat: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[namespace][stat] += n
+
+    def get(self, namespace: str, key: str, default=None):
+        raw = self.memory.get(namespace, key)
+        if raw is not None:
+            self._count(namespace, "memory_hits")
+            return orjson.loads(raw)
+
+        if self.shared is not None:
+            try:
+                item = self.shared.get(namespace, key)
+            except Exception as e:
+                logger.error(f"Shared cache get failed for {namespace}: {e}")
+                item = None
+            if item is not None:
+                raw, expires_at = item
+                self._count(namespace, "shared_hits")
+                # Keep the copy no longer than the entry has left, so short-lived
+                # entries (e.g. rate-limit markers) expire on time in every worker
+                memory_ttl = CACHE_MEMORY_TTL
+                if expires_at is not None:
+                    memory_ttl = min(memory_ttl, expires_at - time.time())
+                if memory_ttl > 0:
+                    self.memory.set(namespace, key, raw, memory_ttl)
+                return orjson.loads(raw)
+
+        self._count(namespace, "misses")
+        return default
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        raw = orjson.dumps(value)
+        if len(raw) > CACHE_MAX_VALUE_BYTES:
+            self._count(namespace, "too_large")
+            return
+        self._count(namespace, "sets")
+        memory_ttl = min(ttl, CACHE_MEMORY_TTL) if ttl else CACHE_MEMORY_TTL
+        self._count(namespace, "evictions", self.memory.set(namespace, key, raw, memory_ttl))
+        if self.shared is not None:
+            try:
+                self._count(namespace, "evictions", self.shared.set(namespace, key, raw, ttl))
+            except Exception as e:
+                logger.error(f"Shared cache set failed for {namespace}: {e}")
+
+    def delete(self, namespace: str, key: str):
+        self.memory.delete(namespace, key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(namespace, key)
+            except Exception as e:
+                logger.error(f"Shared cache delete failed for {namespace}: {e}")
+
+    def stats(self):
+        """
+        Per-namespace counters for this worker, plus entry counts per tier.
+        """
+        with self._stats_lock:
+            namespaces = {ns: dict(counters) for ns, counters in self._stats.items()}
+        for ns, counters in namespaces.items():
+            lookups = counters.get("memory_hits", 0) + counters.get("shared_hits", 0) + counters.get("misses", 0)
+            hits = lookups - counters.get("misses", 0)
+            counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+            counters["memory_entries"] = self.memory.count(ns)
+            if self.shared is not None:
+                try:
+                    counters["shared_entries"] = self.shared.count(ns)
+                except Exception as e:
+                    logger.error(f"Shared cache count failed for {ns}: {e}")
+        return {
+            "backend": type(self.shared).__name__ if self.shared is not None else None,
+            "pid": os.getpid(),
+            "namespaces": namespaces,
+        }
+
+
+class NamespacedCache:
+    """
+    View of the cache for one namespace with a default TTL.
+    """
+
+    def __init__(self, cache: TieredCache, namespace: str, ttl: float = None):
+        self.cache = cache
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key: str, default=None):
+        return self.cache.get(self.namespace, key, default)
+
+    def set(self, key: str, value, ttl: float = None):
+        self.cache.set(self.namespace, key, value, ttl if ttl is not None else self.ttl)
+
+    def delete(self, key: str):
+        self.cache.delete(self.namespace, key)
+
+    def get_or_set(self, key: str, func, ttl: float = None):
+        """
+        Returns the cached value for key, computing and storing it with func()
+        on a miss. None results are not cached.
+        """
+        value = self.get(key)
+        if value is None:
+            value = func()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TieredCache(MemoryBackend(), _create_shared_backend())
+    return _cache
+
+
+def get_cache(namespace: str, ttl: float = None):
+    return NamespacedCache(get_shared_cache(), namespace, ttl)
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import logging
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# How often the loop heartbeat runs, and how late it may be before it counts as a stall
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "0.1"))
+STALL_THRESHOLD = float(os.getenv("STALL_THRESHOLD", "0.5"))
+# Number of recent stalls and lag samples kept for /api/debug/stalls
+STALL_HISTORY = 50
+LAG_SAMPLES = 1000
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_HZ = 1000
+
+
+def _route_from_frames(frame):
+    """
+    Finds the request being handled in a stack by looking for an ASGI `scope`
+    local (Starlette's routing and middleware frames all have one).
+    """
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and scope.get("type") == "http":
+            return f"{scope.get('method')} {scope.get('path')}"
+        frame = frame.f_back
+    return None
+
+
+class LoopWatchdog:
+    """
+    Measures event-loop lag with a heartbeat task. A separate thread checks the
+    heartbeat and, when the loop has been blocked longer than STALL_THRESHOLD,
+    captures the loop thread's stack and the route it is serving.
+    """
+
+    def __init__(self, interval: float = WATCHDOG_INTERVAL, threshold: float = STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._current_stall = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold}s).")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lags.append(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            blocked = time.monotonic() - self._last_beat
+            if blocked >= self.threshold:
+                if self._current_stall is None:
+                    self._record_stall(blocked)
+                else:
+                    self._current_stall["durationMs"] = round(blocked * 1000, 1)
+            elif self._current_stall is not None:
+                stall = self._current_stall
+                self._current_stall = None
+                logger.warning(f"Event loop stall ended after {stall['durationMs']}ms on {stall['route']}.")
+
+    def _record_stall(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame))
+        stall = {
+            "at": time.time(),
+            "route": _route_from_frames(frame),
+            "durationMs": round(blocked * 1000, 1),
+            "stack": stack,
+        }
+        self._current_stall = stall
+        self.stalls.append(stall)
+        logger.warning(
+            f"Event loop blocked for {stall['durationMs']}ms on {stall['route']}. "
+            f"Blocking call stack:\n{stack}"
+        )
+
+    def stats(self):
+        samples = sorted(self.lags)
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "thresholdMs": self.threshold * 1000,
+            "lagMs": {"p50": percentile(0.5), "p99": percentile(0.99), "max": percentile(1.0)},
+            "stalls": list(self.stalls),
+        }
+
+
+watchdog = LoopWatchdog()
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_profile(seconds: float, hz: int = 100):
+    """
+    Samples the stacks of every thread in the process (except the sampler) for
+    `seconds` and returns them in folded format, one "thread;outer;...;inner
+    count" line per distinct stack, ready for flamegraph.pl or speedscope.
+    Only one profile runs at a time; returns None if one is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        interval = 1.0 / min(max(hz, 1), PROFILE_MAX_HZ)
+        own_id = threading.get_ident()
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+    finally:
+        _profile_lock.release()
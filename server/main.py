@@ -6,11 +6,26 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from server.routes import router
+from server.responses import ORJSONResponse, add_compression
+from server.admission import AdmissionControlMiddleware
+from server.diagnostics import watchdog
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Logs the blocking call's stack whenever the event loop stalls
+    watchdog.start()
+    yield
+    await watchdog.stop()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# Admission control for expensive routes; added first so it sits inside CORS
+# and rejections still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
 
 # CORS Middleware
 app.add_middleware(
@@ -21,6 +36,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compression for large responses (contract analyses, dashboard data, chat history)
+add_compression(app)
+
 app.include_router(router)
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+import os
+from decimal import Decimal
+from typing import Any, Optional
+
+import orjson
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+# Responses smaller than this are sent uncompressed; compressing them costs
+# more CPU than it saves on the wire.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+def _default(obj: Any):
+    """
+    Fallback for types orjson does not serialize on its own.
+    """
+    if isinstance(obj, Decimal):
+        # DynamoDB returns every number as Decimal
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if hasattr(obj, "__table__"):
+        # SQLAlchemy ORM rows (ChatSession, ChatMessage, UploadedFile)
+        return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson, with native Decimal and ORM row support.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def parse_fields(fields: Optional[str]):
+    """
+    Parses a `fields=` query value such as "summary,clauses.title" into a nested
+    projection spec: {"summary": True, "clauses": {"title": True}}.
+    """
+    if not fields:
+        return None
+    spec = {}
+    for path in fields.split(","):
+        parts = [p.strip() for p in path.split(".") if p.strip()]
+        if not parts:
+            continue
+        node = spec
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return spec or None
+
+
+def field_requested(fields: Optional[str], name: str) -> bool:
+    """
+    True if `fields=` explicitly names the top-level field `name`, for fields
+    that are only computed or returned on request.
+    """
+    spec = parse_fields(fields)
+    return spec is not None and name in spec
+
+
+def project(data: Any, fields: Optional[str]):
+    """
+    Keeps only the requested fields of a response. Lists are projected element by
+    element, so `fields=id,content` works on a list of messages as well as a dict.
+    """
+    spec = parse_fields(fields)
+    if spec is None:
+        return data
+    return _apply(data, spec)
+
+
+def _apply(data: Any, spec):
+    if spec is True:
+        return data
+    if isinstance(data, list):
+        return [_apply(item, spec) for item in data]
+    if hasattr(data, "__table__"):
+        data = _default(data)
+    if isinstance(data, dict):
+        return {key: _apply(data[key], sub) for key, sub in spec.items() if key in data}
+    return data
+
+
+def add_compression(app: FastAPI):
+    """
+    Adds brotli compression when brotli-asgi is installed (falling back to gzip
+    for clients that do not accept br), otherwise plain gzip.
+    """
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE, compresslevel=GZIP_LEVEL)
+        return
+    app.add_middleware(
+        BrotliMiddleware,
+        quality=BROTLI_QUALITY,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_fallback=True,
+    )
@@ -1,16 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Security
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import List
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 import os
 import shutil
 import json
 import boto3
 
-from server.storage import get_db, create_chat_session, get_chat_session, get_chat_messages, add_chat_message, save_uploaded_file
+from server.storage import get_db, create_chat_session, get_chat_session, get_chat_messages, add_chat_message, save_uploaded_file, search_chat_messages
 from shared.schema import InsertChatSession, InsertChatMessage, Expert
 from server.services.model import generate_legal_advice, analyze_document, analyze_labour_contract, analyze_labour_contract_file
 from server.services.transcribe import transcribe_audio
 from server.services.experts import get_expert_recommendations
 from server.user_statistics import get_all_statistics
+from server.responses import ORJSONResponse, project, parse_fields, field_requested
+from server.cache import get_shared_cache
+from server.admission import get_admission_stats
+from server.diagnostics import watchdog, sample_profile
+from server.auth import verify_token, verify_operator, is_support, optional_bearer_scheme
 
 router = APIRouter()
 
@@ -18,6 +27,12 @@ UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
+# The async routes below run their blocking work (file copies, boto3, PyPDF2)
+# through run_in_threadpool so it does not stall the event loop for other requests.
+def save_upload(upload: UploadFile, file_path: str):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
 @router.post("/api/chat/session")
 def post_chat_session(session_data: InsertChatSession, db: Session = Depends(get_db)):
     return create_chat_session(db, session_data)
@@ -30,8 +45,31 @@ def get_session(session_id: str, db: Session = Depends(get_db)):
     return session
 
 @router.get("/api/chat/session/{session_id}/messages")
-def get_messages(session_id: str, db: Session = Depends(get_db)):
-    return get_chat_messages(db, session_id)
+def get_messages(session_id: str, fields: str = Query(None), db: Session = Depends(get_db)):
+    return ORJSONResponse(project(get_chat_messages(db, session_id), fields))
+
+@router.get("/api/chat/search")
+def search_messages(
+    q: str = Query(..., min_length=1),
+    sessionId: List[str] = Query(None),
+    role: str = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    credentials: HTTPAuthorizationCredentials = Security(optional_bearer_scheme),
+    db: Session = Depends(get_db),
+):
+    """
+    Searches the given sessions (repeat sessionId for several). Searching all
+    sessions requires a token from the support group.
+    """
+    if sessionId and len(sessionId) > 50:
+        raise HTTPException(status_code=400, detail="Too many sessionId values (max 50)")
+    if not sessionId:
+        if credentials is None:
+            raise HTTPException(status_code=400, detail="sessionId is required")
+        if not is_support(verify_token(credentials)):
+            raise HTTPException(status_code=403, detail="Searching all sessions requires the support role")
+    return ORJSONResponse(search_chat_messages(db, q, session_ids=sessionId, role=role, limit=limit, offset=offset))
 
 @router.post("/api/chat/message")
 def post_chat_message(message_data: InsertChatMessage, db: Session = Depends(get_db)):
@@ -52,10 +90,9 @@ def post_chat_message(message_data: InsertChatMessage, db: Session = Depends(get
     return {"userMessage": user_message, "assistantMessage": assistant_message}
 
 @router.post("/api/upload")
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_file(file: UploadFile = File(...), fields: str = Query(None), db: Session = Depends(get_db)):
     file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await run_in_threadpool(save_upload, file, file_path)
 
     file_data = {
         "filename": file.filename,
@@ -63,11 +100,11 @@ async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db
         "mimeType": file.content_type,
         "size": os.path.getsize(file_path)
     }
-    uploaded_file = save_uploaded_file(db, file_data)
+    uploaded_file = await run_in_threadpool(save_uploaded_file, db, file_data)
     
-    analysis = analyze_document(file_path, file.content_type)
+    analysis = await run_in_threadpool(analyze_document, file_path, file.content_type)
     
-    return {"file": uploaded_file, "analysis": analysis}
+    return ORJSONResponse(project({"file": uploaded_file, "analysis": analysis}, fields))
 
 @router.post("/api/transcribe")
 async def transcribe_endpoint(language: str = Form(...), audio: UploadFile = File(...)):
@@ -79,39 +116,79 @@ async def transcribe_endpoint(language: str = Form(...), audio: UploadFile = Fil
     aws_language_code = language_map.get(language, "en-US")
 
     file_path = os.path.join(UPLOAD_DIR, audio.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(audio.file, buffer)
-        
-    transcript_text = transcribe_audio(file_path, aws_language_code)
+    await run_in_threadpool(save_upload, audio, file_path)
+
+    transcript_text = await run_in_threadpool(transcribe_audio, file_path, aws_language_code)
     os.remove(file_path) # Clean up the file
     return {"transcript": transcript_text}
 
+# The analyzed document text is only echoed back when requested, e.g.
+# `fields=summary,clauses,documentText`
 @router.post("/api/analyze-labour-contract")
-async def analyze_labour_contract_endpoint(data: dict):
+async def analyze_labour_contract_endpoint(data: dict, fields: str = Query(None)):
     document_text = data.get("documentText")
     if not document_text:
         raise HTTPException(status_code=400, detail="No document text provided")
-    analysis_result = analyze_labour_contract(document_text)
-    return analysis_result
+    analysis_result = await run_in_threadpool(
+        analyze_labour_contract, document_text, field_requested(fields, "documentText")
+    )
+    return ORJSONResponse(project(analysis_result, fields))
 
 @router.post("/api/analyze-labour-contract-file")
-async def analyze_labour_contract_file_endpoint(file: UploadFile = File(...)):
+async def analyze_labour_contract_file_endpoint(file: UploadFile = File(...), fields: str = Query(None)):
     file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await run_in_threadpool(save_upload, file, file_path)
     
-    analysis_result = analyze_labour_contract_file(file_path, file.content_type)
+    analysis_result = await run_in_threadpool(
+        analyze_labour_contract_file, file_path, file.content_type, field_requested(fields, "documentText")
+    )
     os.remove(file_path) # Clean up the file
-    return analysis_result
+    return ORJSONResponse(project(analysis_result, fields))
 
 @router.post("/api/experts")
 async def experts_endpoint(data: dict):
     prompt = data.get("prompt")
     if not prompt:
         raise HTTPException(status_code=400, detail="No prompt provided")
-    experts = get_expert_recommendations(prompt)
+    experts = await run_in_threadpool(get_expert_recommendations, prompt)
     return {"experts": experts}
 
+@router.get("/api/cache/stats")
+def get_cache_stats(user: dict = Depends(verify_operator)):
+    """
+    Hit/miss counters of this worker and entry counts of the shared cache.
+    """
+    return get_shared_cache().stats()
+
+@router.get("/api/admission/stats")
+def admission_stats(request: Request):
+    """
+    Per-route concurrency, queue length, rejections and queue time percentiles.
+    """
+    return get_admission_stats(request.app)
+
+@router.get("/api/debug/stalls")
+def get_stalls(user: dict = Depends(verify_operator)):
+    """
+    Event-loop lag percentiles and the most recent stalls with their stacks.
+    """
+    return watchdog.stats()
+
+@router.get("/api/debug/profile", response_class=PlainTextResponse)
+async def get_profile(
+    seconds: float = Query(10, gt=0, le=60),
+    hz: int = Query(100, ge=1, le=1000),
+    user: dict = Depends(verify_operator),
+):
+    """
+    Samples every thread of this worker for `seconds` and returns folded stacks
+    (flamegraph.pl / speedscope format).
+    """
+    profile = await run_in_threadpool(sample_profile, seconds, hz)
+    if profile is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(profile)
+
 @router.get("/api/legal-topics")
 def get_legal_topics():
     topics = [
@@ -158,24 +235,18 @@ def get_experts():
 from server.user_statistics import get_all_statistics
 
 @router.get("/api/dashboard-data")
-def get_dashboard_data():
+def get_dashboard_data(fields: str = Query(None)):
     """
     Fetches and returns a list of employment data from DynamoDB for the dashboard.
+    Decimals are serialized natively by ORJSONResponse. With e.g.
+    `fields=analysisResult.keyMetrics`, the scan only returns the named
+    top-level attributes and the response is trimmed to the requested paths.
+    The scan still reads (and is billed for) every whole item.
     """
-    data = get_all_statistics()
+    spec = parse_fields(fields)
+    data = get_all_statistics(list(spec) if spec else None)
     
     if data is None:
         raise HTTPException(status_code=500, detail="Error fetching data from DynamoDB")
 
-    # Convert Decimal to float for JSON serialization
-    for item in data:
-        if 'analysisResult' in item and 'keyMetrics' in item['analysisResult']:
-            key_metrics = item['analysisResult']['keyMetrics']
-            if 'salary' in key_metrics:
-                key_metrics['salary'] = float(key_metrics['salary'])
-            if 'workingHours' in key_metrics:
-                key_metrics['workingHours'] = float(key_metrics['workingHours'])
-            if 'annualLeave' in key_metrics:
-                key_metrics['annualLeave'] = float(key_metrics['annualLeave'])
-                
-    return data
\ No newline at end of file
+    return ORJSONResponse(project(data, fields))
@@ -0,0 +1,147 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+TARGET_SAMPLE_RATE = 16000
+# Bytes of 16-bit mono PCM read from the decoder at a time (~0.5 s)
+CHUNK_BYTES = 16000
+# Frames are classed as silent when their peak is below this (about -36 dBFS)
+SILENCE_PEAK = int(os.getenv("AUDIO_SILENCE_PEAK", "500"))
+FRAME_SAMPLES = TARGET_SAMPLE_RATE * 30 // 1000
+# Internal pauses are buffered until speech resumes so trailing silence can be
+# dropped; past this length the buffer is flushed to keep memory bounded
+MAX_SILENCE_BYTES = TARGET_SAMPLE_RATE * 2 * 30
+FFMPEG = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+
+
+def detect_audio_format(file_path: str):
+    """
+    Detects the container from the file's magic bytes and returns the matching
+    Transcribe MediaFormat, or None if it is not recognized. Browsers label
+    MediaRecorder output as .wav even when it is WebM or MP4.
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(36)
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    if header[:6] == b"#!AMR\n":
+        return "amr"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+def _is_silent(frame: bytes) -> bool:
+    samples = array("h", frame)
+    return not samples or max(max(samples), -min(samples)) < SILENCE_PEAK
+
+
+def _trim_silence(chunks):
+    """
+    Yields PCM with leading and trailing silence removed, frame by frame.
+    """
+    frame_bytes = FRAME_SAMPLES * 2
+    pending = b""
+    silence = bytearray()
+    started = False
+    for chunk in chunks:
+        pending += chunk
+        usable = len(pending) - len(pending) % frame_bytes
+        frames, pending = pending[:usable], pending[usable:]
+        for offset in range(0, len(frames), frame_bytes):
+            frame = frames[offset:offset + frame_bytes]
+            if _is_silent(frame):
+                if started:
+                    silence += frame
+                    if len(silence) > MAX_SILENCE_BYTES:
+                        yield bytes(silence)
+                        silence.clear()
+                continue
+            started = True
+            if silence:
+                yield bytes(silence)
+                silence.clear()
+            yield frame
+    if started and pending and not _is_silent(pending):
+        if silence:
+            yield bytes(silence)
+        yield pending
+
+
+def _read_chunks(stream):
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+def normalize_audio(file_path: str):
+    """
+    Re-encodes a recording for Transcribe: mono, 16 kHz, leading/trailing
+    silence trimmed, FLAC. Audio is streamed from an ffmpeg decoder through the
+    silence trimmer into an ffmpeg FLAC encoder, so memory stays bounded
+    whatever the recording length.
+
+    Returns (path, media_format, sample_rate). The path is a new temporary
+    file, or file_path itself when ffmpeg is unavailable or fails; the
+    original is then uploaded as-is with its detected format.
+    """
+    media_format = detect_audio_format(file_path) or "wav"
+    if not FFMPEG:
+        logger.warning("ffmpeg not found; uploading audio without normalization.")
+        return file_path, media_format, None
+
+    fd, output_path = tempfile.mkstemp(suffix=".flac")
+    os.close(fd)
+    decoder = subprocess.Popen(
+        [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", file_path,
+         "-vn", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE), "-f", "s16le", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    encoder = subprocess.Popen(
+        [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "s16le", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE), "-i", "-",
+         "-c:a", "flac", output_path],
+        stdin=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    written = 0
+    try:
+        for pcm in _trim_silence(_read_chunks(decoder.stdout)):
+            encoder.stdin.write(pcm)
+            written += len(pcm)
+        encoder.stdin.close()
+        decoder_status = decoder.wait()
+        encoder_status = encoder.wait()
+    except (BrokenPipeError, OSError) as e:
+        logger.error(f"Audio normalization failed: {e}")
+        decoder_status = encoder_status = -1
+    finally:
+        for process in (decoder, encoder):
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    if decoder_status != 0 or encoder_status != 0 or written == 0:
+        logger.warning(f"Could not normalize {media_format} audio; uploading the original.")
+        os.remove(output_path)
+        return file_path, media_format, None
+
+    logger.info(
+        f"Normalized {media_format} audio: {os.path.getsize(file_path)} -> "
+        f"{os.path.getsize(output_path)} bytes, {written / (2 * TARGET_SAMPLE_RATE):.1f}s of speech."
+    )
+    return output_path, "flac", TARGET_SAMPLE_RATE
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+
+from server.cache import get_cache
+
+# Fields kept for each cached clause analysis
+CLAUSE_FIELDS = ("title", "color", "explanation", "whyItMatters", "suggestion", "originalText")
+
+CLAUSE_CACHE_TTL = int(os.getenv("CLAUSE_CACHE_TTL", str(7 * 24 * 3600)))
+
+# A new segment starts on a blank line or on a line that looks like a clause
+# heading: "1.", "2.3)", "Clause 4", "Section 5", "(a)", or an ALL CAPS title.
+_HEADING_RE = re.compile(
+    r"^\s*("
+    r"\d+(\.\d+)*[.)]\s+"
+    r"|\(?[a-z]\)\s+"
+    r"|(?i:clause|section|article)\s+\d+"
+    r"|[A-Z][A-Z0-9 ,&/\-]{3,}:?\s*$"
+    r")"
+)
+_NUMBERING_RE = re.compile(
+    r"^\s*((clause|section|article)\s+\d+(\.\d+)*[.):]?|\d+(\.\d+)*[.)](?=\s)|\(?[a-z]\))\s*",
+    re.IGNORECASE,
+)
+# Numbering that normalize_clause drops at the start of a continuation line
+_LINE_NUMBERING = r"(?:(?:clause|section|article)\s+\d+(?:\.\d+)*[.):]?\s*|\d+(?:\.\d+)*[.)]\s+|\(?[a-z]\)\s*)?"
+
+# Segments shorter than this (headings, signature lines) are folded into the
+# following segment so they are analyzed with their body text.
+_MIN_SEGMENT_CHARS = 40
+
+# Segments the model may legitimately return no clauses for: short headings or
+# signature/witness blocks
+_TRIVIAL_SEGMENT_WORDS = 12
+_SIGNATURE_RE = re.compile(r"\b(signed|signature|witness|tandatangan|saksi)\b", re.IGNORECASE)
+_SIGNATURE_SEGMENT_CHARS = 300
+
+
+def split_clauses(document_text: str):
+    """
+    Splits contract text into clause-sized segments, in document order.
+    """
+    segments = []
+    current = []
+    for line in document_text.splitlines():
+        if not line.strip():
+            if current:
+                segments.append("\n".join(current))
+                current = []
+            continue
+        if _HEADING_RE.match(line) and current:
+            segments.append("\n".join(current))
+            current = []
+        current.append(line.rstrip())
+    if current:
+        segments.append("\n".join(current))
+
+    merged = []
+    carry = ""
+    for segment in segments:
+        segment = f"{carry}\n{segment}" if carry else segment
+        if len(segment.strip()) < _MIN_SEGMENT_CHARS:
+            carry = segment
+            continue
+        merged.append(segment)
+        carry = ""
+    if carry:
+        if merged:
+            merged[-1] = f"{merged[-1]}\n{carry}"
+        else:
+            merged.append(carry)
+    return merged
+
+
+def normalize_clause(text: str) -> str:
+    """
+    Normalizes a clause so that renumbering, case and whitespace edits do not
+    change its fingerprint.
+    """
+    lines = [_NUMBERING_RE.sub("", line, count=1) for line in text.splitlines()]
+    return re.sub(r"\s+", " ", " ".join(lines)).strip().lower()
+
+
+def clause_heading(text: str, max_words: int = 12) -> str:
+    """
+    Short heading for a clause segment: its first line without numbering,
+    cut to max_words words.
+    """
+    for line in text.splitlines():
+        words = _NUMBERING_RE.sub("", line, count=1).split()
+        if words:
+            return " ".join(words[:max_words])
+    return ""
+
+
+def verbatim_text(original: str, segment: str) -> str:
+    """
+    Returns original if it appears verbatim in segment. Otherwise returns the
+    span of segment it matches after normalization (a cached analysis may come
+    from a version of the clause with other numbering, case or whitespace), or
+    the whole segment if there is no such span.
+    """
+    if original and original in segment:
+        return original
+    words = normalize_clause(original or "").split()
+    if words:
+        separator = r"\s+" + _LINE_NUMBERING
+        match = re.search(separator.join(re.escape(word) for word in words), segment, re.IGNORECASE)
+        if match:
+            return match.group(0)
+    return segment
+
+
+def is_trivial_segment(text: str) -> bool:
+    """
+    True for segments with nothing to analyze, such as a title or a signature
+    block. Only these have an empty analysis cached; for any other segment an
+    empty result means the model skipped it, and it is retried next time.
+    """
+    normalized = normalize_clause(text)
+    if len(normalized.split()) < _TRIVIAL_SEGMENT_WORDS:
+        return True
+    return len(normalized) < _SIGNATURE_SEGMENT_CHARS and bool(_SIGNATURE_RE.search(normalized))
+
+
+def clause_hash(text: str) -> str:
+    return hashlib.sha256(normalize_clause(text).encode("utf-8")).hexdigest()
+
+
+class ClauseCache:
+    """
+    Cache key -> list of analyzed clauses for that segment, kept in the shared
+    cache so every worker benefits. Callers build the key from the clause hash
+    plus the model and prompt version, so either changing invalidates it.
+    """
+
+    def __init__(self, ttl: int = CLAUSE_CACHE_TTL):
+        self._cache = get_cache("clauses", ttl=ttl)
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, clauses):
+        """
+        Stores the analysis and returns the stored (field-filtered) clauses. The
+        cache may drop the entry (size limit, eviction), so callers should use
+        the return value rather than reading it back.
+        """
+        clauses = [{field: clause.get(field) for field in CLAUSE_FIELDS} for clause in clauses]
+        self._cache.set(key, clauses)
+        return clauses
+
+
+clause_cache = ClauseCache()
+
+
+def summarize_clauses(clauses):
+    return {
+        "criticalIssues": sum(1 for clause in clauses if clause.get("color") == "Red"),
+        "areasForCaution": sum(1 for clause in clauses if clause.get("color") == "Yellow"),
+    }
@@ -0,0 +1,147 @@
+import math
+import os
+import re
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the <knowledge_base_context> block of contract prompts
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Chunks whose shingle Jaccard similarity to an already kept chunk is at or
+# above this are treated as near-duplicates
+DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.6"))
+# Chunks scoring below this against every clause are treated as unrelated,
+# except that the CONTEXT_MIN_CHUNKS best ranked chunks are always kept. The
+# reranker is lexical, so Malay clauses score ~0 against the English knowledge
+# base; then retrieval order (the KB's own cross-lingual ranking) decides.
+MIN_RELEVANCE = float(os.getenv("CONTEXT_MIN_RELEVANCE", "0.05"))
+MIN_CHUNKS = int(os.getenv("CONTEXT_MIN_CHUNKS", "5"))
+
+SHINGLE_SIZE = 5
+# Bedrock retrieve() rejects longer query text
+MAX_QUERY_CHARS = 1000
+
+_STOPWORDS = set(
+    "a an the and or of to in on for by with as at from is are be been was were this that these those "
+    "it its shall will may must not no any all such other than into under upon which who whom "
+    "dan atau yang di ke dari untuk dengan ini itu adalah akan tidak oleh pada".split()
+)
+
+
+def tokenize(text: str):
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in _STOPWORDS and len(word) > 1]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (~4 characters per token), good enough for budgeting.
+    """
+    return (len(text) + 3) // 4
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def dedupe_chunks(chunks):
+    """
+    Drops chunks that are near-duplicates of an earlier (higher ranked) chunk.
+    """
+    kept, kept_shingles = [], []
+    for chunk in chunks:
+        chunk_shingles = shingles(chunk)
+        if any(jaccard(chunk_shingles, other) >= DEDUP_THRESHOLD for other in kept_shingles):
+            continue
+        kept.append(chunk)
+        kept_shingles.append(chunk_shingles)
+    return kept
+
+
+def rerank_chunks(chunks, clauses):
+    """
+    Scores each chunk by its best TF-IDF cosine similarity to any clause and
+    returns (score, chunk) pairs, best first. Ties keep retrieval order.
+    """
+    chunk_terms = [Counter(tokenize(chunk)) for chunk in chunks]
+    clause_terms = [Counter(tokenize(clause)) for clause in clauses]
+    documents = chunk_terms + clause_terms
+    df = Counter(term for terms in documents for term in terms)
+    n = len(documents)
+
+    def vector(terms):
+        vec = {term: (1 + math.log(count)) * math.log(1 + n / df[term]) for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vec.values())) or 1.0
+        return {term: weight / norm for term, weight in vec.items()}
+
+    clause_vectors = [vector(terms) for terms in clause_terms if terms]
+    scored = []
+    for index, (chunk, terms) in enumerate(zip(chunks, chunk_terms)):
+        chunk_vector = vector(terms)
+        score = max(
+            (sum(weight * clause_vector.get(term, 0.0) for term, weight in chunk_vector.items())
+             for clause_vector in clause_vectors),
+            default=0.0,
+        )
+        scored.append((score, index, chunk))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [(score, chunk) for score, _, chunk in scored]
+
+
+def assemble_context(chunks, clauses, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Builds the knowledge base context for a contract prompt: dedupes the
+    retrieved chunks, reranks them against the clauses and packs the best ones
+    under token_budget, keeping at least the MIN_CHUNKS best ranked chunks that
+    fit. Returns (context_text, stats).
+    """
+    tokens_in = sum(estimate_tokens(chunk) for chunk in chunks)
+    unique = dedupe_chunks(chunks)
+    ranked = rerank_chunks(unique, clauses) if clauses else [(1.0, chunk) for chunk in unique]
+
+    selected, used, irrelevant = [], 0, 0
+    for rank, (score, chunk) in enumerate(ranked):
+        if score < MIN_RELEVANCE and rank >= MIN_CHUNKS:
+            irrelevant += 1
+            continue
+        tokens = estimate_tokens(chunk)
+        if used + tokens > token_budget:
+            continue
+        selected.append(chunk)
+        used += tokens
+
+    stats = {
+        "chunksRetrieved": len(chunks),
+        "duplicatesDropped": len(chunks) - len(unique),
+        "irrelevantDropped": irrelevant,
+        "chunksUsed": len(selected),
+        "tokensRetrieved": tokens_in,
+        "tokensUsed": used,
+        "tokensSaved": tokens_in - used,
+    }
+    logger.info(f"Assembled knowledge base context: {stats}")
+    return "\n\n".join(selected), stats
+
+
+def retrieval_query(headings):
+    """
+    Builds the KB retrieval query from clause headings, capped to the length
+    Bedrock accepts. A heading that does not fit is skipped, not the rest, so
+    later clauses still shape the query.
+    """
+    query = ""
+    for heading in headings:
+        candidate = f"{query}; {heading}" if query else heading
+        if len(candidate) > MAX_QUERY_CHARS:
+            continue
+        query = candidate
+    return query
@@ -1,12 +1,18 @@
+import asyncio
 import boto3
 import os
 import json
 import re
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from botocore.exceptions import BotoCoreError, ClientError
 import PyPDF2
 from deep_translator import GoogleTranslator
+from server.cache import get_cache
+from server.services.clauses import split_clauses, clause_hash, clause_heading, normalize_clause, is_trivial_segment, verbatim_text, clause_cache, summarize_clauses
+from server.services.context import assemble_context, retrieval_query
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,10 +33,32 @@ except (BotoCoreError, ClientError) as e:
     logger.error(f"Failed to initialize AWS clients: {e}")
     raise
 
+# Shared across workers; translations and categories are deterministic per input
+translation_cache = get_cache("translations", ttl=int(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 3600))))
+category_cache = get_cache("categories", ttl=int(os.getenv("CATEGORY_CACHE_TTL", str(7 * 24 * 3600))))
+
+
+def _cache_key(*parts: str):
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
 def categorize_prompt(prompt: str):
     if not MODEL_ID:
         raise ValueError("MODEL_ID is not configured.")
 
+    key = _cache_key(MODEL_ID, prompt.strip().lower())
+    cached = category_cache.get(key)
+    if cached is not None:
+        return cached
+    matched_specializations = _categorize_prompt(prompt)
+    # Empty results may come from a transient error, so only cache real matches
+    if matched_specializations:
+        category_cache.set(key, matched_specializations)
+    return matched_specializations
+
+
+def _categorize_prompt(prompt: str):
+
     specializations = [
         "Employment & Labor Law",
         "Industrial Relations & Unions",
@@ -99,86 +127,242 @@ Matching Specializations (JSON Array):"""
         logger.error(f"Unexpected error in categorization: {e}", exc_info=True)
         return []
 
-def generate_legal_advice(prompt: str, document_context: str = None):
+# Per-stage deadlines (seconds) for generate_legal_advice. A stage that misses
+# its deadline degrades (default language, untranslated text, direct model
+# fallback) instead of failing the chat turn.
+DETECT_TIMEOUT = float(os.getenv("DETECT_TIMEOUT", "2"))
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "5"))
+KB_TIMEOUT = float(os.getenv("KB_TIMEOUT", "30"))
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "30"))
+# Start a KB call on the raw prompt while the language is detected (and a
+# Malay prompt translated), instead of only after translation
+SPECULATIVE_KB = os.getenv("SPECULATIVE_KB", "true").lower() == "true"
+
+# Dedicated pools for blocking stage calls. Unlike the loop's default executor,
+# asyncio.run() does not wait for them on exit, so a stage that misses its
+# deadline does not hold up the response. An abandoned stage still holds its
+# thread until the call returns, so the slow KB/model calls get their own pool
+# and cannot starve the short detect/translate stages of threads. The defaults
+# are 3x and 2x the chat admission limit of 16 (see server/admission.py): each
+# chat runs one or two stages of each kind at a time, plus abandoned ones
+# still finishing. Raise them when raising the cap with ADMISSION_CHAT.
+MODEL_STAGE_WORKERS = int(os.getenv("MODEL_STAGE_WORKERS", "48"))
+SHORT_STAGE_WORKERS = int(os.getenv("SHORT_STAGE_WORKERS", "32"))
+_model_executor = ThreadPoolExecutor(max_workers=MODEL_STAGE_WORKERS, thread_name_prefix="advice-model")
+_short_executor = ThreadPoolExecutor(max_workers=SHORT_STAGE_WORKERS, thread_name_prefix="advice-short")
+
+LEGAL_ADVICE_SYSTEM_PROMPT = (
+    "You are a Malaysian AI legal assistant specializing in employment and labor law. "
+    "Your role is to answer questions from Malaysian citizens about their rights and obligations under employment regulations. "
+    "Use clear and simple sentences. "
+    "If the question is outside this domain, politely decline stating that it is not within your area of knowledge. "
+    "Provide only legal information and explanations, not personal opinions, provide legal references where applicable."
+)
+
+FALLBACK_ANSWER = "Sorry, I could not generate a response."
+
+
+def _build_advice_prompt(query_text: str, document_context: str = None, same_language: bool = False):
+    system_prompt = LEGAL_ADVICE_SYSTEM_PROMPT
+    if same_language:
+        system_prompt += " Reply in the same language as the user query."
+    if document_context:
+        return f"{system_prompt}\n\nDocument Context:\n{document_context}\n\nUser Query:\n{query_text}"
+    return f"{system_prompt}\n\nUser Query: {query_text}"
+
+
+def _detect_language(prompt: str):
+    detected = comprehend_client.detect_dominant_language(Text=prompt)
+    detected_lang = detected["Languages"][0]["LanguageCode"]
+    logger.info(f"Detected language: {detected_lang}")
+    # Treat Indonesian ('id') as Malay ('ms') for this context
+    return "ms" if detected_lang == "id" else detected_lang
+
+
+def _translate(text: str, source: str, target: str):
+    return translation_cache.get_or_set(
+        _cache_key(source, target, text),
+        lambda: GoogleTranslator(source=source, target=target).translate(text)
+    )
+
+
+def _kb_generate(full_prompt: str):
+    response = bedrock_agent_client.retrieve_and_generate(
+        input={"text": full_prompt},
+        retrieveAndGenerateConfiguration={
+            "knowledgeBaseConfiguration": {
+                "knowledgeBaseId": KNOWLEDGE_BASE_ID,
+                "modelArn": MODEL_ARN
+            },
+            "type": "KNOWLEDGE_BASE"
+        }
+    )
+    references = []
+    for citation in response.get("citations", []):
+        for reference in citation.get("retrievedReferences", []):
+            references.append({
+                "text": reference["content"]["text"],
+                "uri": reference["location"]["s3Location"]["uri"]
+            })
+    return {"answer": response["output"]["text"], "references": references}
+
+
+def _direct_generate(full_prompt: str):
+    if not MODEL_ID:
+        raise ValueError("MODEL_ID is not configured.")
+    request_payload = {
+        "prompt": full_prompt,
+        "max_gen_len": 2048,
+        "temperature": 0.2
+    }
+    response = bedrock_client.invoke_model(
+        modelId=MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps(request_payload)
+    )
+    response_body = json.loads(response['body'].read().decode('utf-8'))
+    answer = response_body.get("generation", "").strip()
+    if not answer:
+        raise ValueError("Model returned an empty generation.")
+    return {"answer": answer, "references": []}
+
+
+def _start_stage(stages: list, executor: ThreadPoolExecutor, func, *args):
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, func, *args)
+    stages.append(future)
+    return future
+
+
+async def _await_stage(name: str, future, timeout: float, default=None):
     """
-    Generates legal advice using the Bedrock model, optionally using a knowledge base,
-    and includes language detection and translation.
+    Awaits a stage with a deadline, returning `default` if it fails or is late.
+    The future is shielded so a late stage can still be awaited by another path.
     """
-    # 1. Detect language using Comprehend
     try:
-        detected = comprehend_client.detect_dominant_language(Text=prompt)
-        detected_lang = detected["Languages"][0]["LanguageCode"]
-        logger.info(f"Detected language: {detected_lang}")
-    except (ClientError, BotoCoreError) as e:
-        logger.error(f"Comprehend error: {e}. Defaulting to English.")
-        detected_lang = "en"
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Stage '{name}' missed its {timeout:.1f}s deadline.")
+    except Exception as e:
+        logger.error(f"Stage '{name}' failed: {e}")
+    return default
 
-    # Treat Indonesian ('id') as Malay ('ms') for this context
-    if detected_lang == "id":
-        detected_lang = "ms"
 
-    # 2. Translate to English if necessary for the model/KB query
-    query_text = prompt
+def _deadline(timeout: float) -> float:
+    return asyncio.get_running_loop().time() + timeout
+
+
+def _remaining(deadline: float) -> float:
+    # Stages awaited after others keep the deadline they were started with
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+
+async def generate_legal_advice_async(prompt: str, document_context: str = None):
+    """
+    Stage graph behind generate_legal_advice. With SPECULATIVE_KB (default):
+
+        KB(raw prompt, reply in the user's language) ──────┐
+        detect ──> translate ms->en (Malay prompts only) ──┤
+                                                           v
+        English prompt, or answer detected as Malay ──> answer as is
+        Malay prompt, answer in English ──────────────> translate en->ms
+        raw KB call failed ──> KB(translated query) / direct model
+                               ──> translate en->ms (if the query was translated)
+
+    The raw KB call overlaps detection and translation, so English prompts
+    cost one KB call and no extra wait. Without SPECULATIVE_KB:
+
+        detect ──> translate ms->en ──> KB / direct model ──> translate en->ms
+                                                              (only if needed)
+    """
+    stages = []
+    try:
+        return await _run_advice_stages(stages, prompt, document_context)
+    finally:
+        # Drop stages whose result is no longer needed; ones not yet picked up
+        # by a worker thread are never run.
+        for future in stages:
+            future.cancel()
+
+
+async def _run_advice_stages(stages: list, prompt: str, document_context: str = None):
+    use_kb = bool(KNOWLEDGE_BASE_ID and MODEL_ARN)
+
+    raw_kb = None
+    if use_kb and SPECULATIVE_KB:
+        logger.info("Attempting to retrieve from knowledge base with the raw prompt...")
+        raw_prompt = _build_advice_prompt(prompt, document_context, same_language=True)
+        raw_kb = _start_stage(stages, _model_executor, _kb_generate, raw_prompt)
+        raw_kb_deadline = _deadline(KB_TIMEOUT)
+
+    detect = _start_stage(stages, _short_executor, _detect_language, prompt)
+    detected_lang = await _await_stage("detect", detect, DETECT_TIMEOUT, default="en")
+
+    translate = None
     if detected_lang == "ms":
-        try:
-            query_text = GoogleTranslator(source="ms", target="en").translate(prompt)
+        translate = _start_stage(stages, _short_executor, _translate, prompt, "ms", "en")
+        translate_deadline = _deadline(TRANSLATE_TIMEOUT)
+
+    if raw_kb is not None:
+        result = await _await_stage("kb", raw_kb, _remaining(raw_kb_deadline))
+        if result is not None:
+            if detected_lang != "ms":
+                return result
+            # The model was asked to reply in the user's language; check it did
+            answer_detect = _start_stage(stages, _short_executor, _detect_language, result["answer"])
+            if await _await_stage("detect answer", answer_detect, DETECT_TIMEOUT) == "ms":
+                return result
+            return await _translate_answer(stages, result)
+
+    query_text = prompt
+    if translate is not None:
+        query_text = await _await_stage("translate ms->en", translate, _remaining(translate_deadline), default=prompt)
+        if query_text != prompt:
             logger.info(f"Translated Malay input to English for KB query: '{query_text}'")
-        except Exception as e:
-            logger.error(f"Translation error: {e}. Using original prompt.")
-            query_text = prompt
-
-    system_prompt = (
-        "You are a Malaysian AI legal assistant specializing in employment and labor law. "
-        "Your role is to answer questions from Malaysian citizens about their rights and obligations under employment regulations. "
-        "Use clear and simple sentences. "
-        "If the question is outside this domain, politely decline stating that it is not within your area of knowledge. "
-        "Provide only legal information and explanations, not personal opinions, provide legal references where applicable."
-    )
+    # Translate back to Malay only if the answer was generated from the English query
+    needs_translation = detected_lang == "ms" and query_text != prompt
 
-    full_prompt = f"{system_prompt}\n\nUser Query: {query_text}"
-    if document_context:
-        full_prompt = f"{system_prompt}\n\nDocument Context:\n{document_context}\n\nUser Query:\n{query_text}" 
-        
-    # Use Knowledge Base if configured
-    if KNOWLEDGE_BASE_ID and MODEL_ARN:
+    result = None
+    full_prompt = _build_advice_prompt(query_text, document_context)
+    # No point repeating a failed raw KB call with the same query
+    if use_kb and (raw_kb is None or query_text != prompt):
         logger.info("Attempting to retrieve from knowledge base...")
-        try:
-            response = bedrock_agent_client.retrieve_and_generate(
-                input={"text": full_prompt},
-                retrieveAndGenerateConfiguration={
-                    "knowledgeBaseConfiguration": {
-                        "knowledgeBaseId": KNOWLEDGE_BASE_ID,
-                        "modelArn": MODEL_ARN
-                    },
-                    "type": "KNOWLEDGE_BASE"
-                }
-            )
-            answer = response["output"]["text"]
-            citations = response.get("citations", [])
-            references = []
-            if citations:
-                for citation in citations:
-                    for reference in citation.get("retrievedReferences", []):
-                        references.append({
-                            "text": reference["content"]["text"],
-                            "uri": reference["location"]["s3Location"]["uri"]
-                        })
-
-            # 4. Translate back to Malay if the original query was in Malay
-            if detected_lang == "ms":
-                answer = GoogleTranslator(source="en", target="ms").translate(answer)
-                logger.info("Translated English response back to Malay.")
-            
-            return {"answer": answer, "references": references}
-        except (ClientError, BotoCoreError) as e:
-            logger.error(f"Error with knowledge base retrieval: {e}")
-            pass
+        kb = _start_stage(stages, _model_executor, _kb_generate, full_prompt)
+        result = await _await_stage("kb", kb, KB_TIMEOUT)
 
-    if detected_lang == "ms":
-        answer = GoogleTranslator(source="en", target="ms").translate(answer)
+    if result is None:
+        logger.info("Falling back to direct model invocation...")
+        direct = _start_stage(stages, _model_executor, _direct_generate, full_prompt)
+        result = await _await_stage("direct model", direct, MODEL_TIMEOUT)
+
+    if result is None:
+        return {"answer": FALLBACK_ANSWER, "references": []}
+
+    if needs_translation:
+        result = await _translate_answer(stages, result)
+    return result
+
+
+async def _translate_answer(stages: list, result: dict):
+    reply = _start_stage(stages, _short_executor, _translate, result["answer"], "en", "ms")
+    translated = await _await_stage("translate en->ms", reply, TRANSLATE_TIMEOUT)
+    if translated:
+        result["answer"] = translated
         logger.info("Translated English response back to Malay.")
+    return result
+
+
+def generate_legal_advice(prompt: str, document_context: str = None):
+    """
+    Generates legal advice using the Bedrock model, optionally using a knowledge base,
+    and includes language detection and translation.
 
-    return answer
+    Returns a dict with "answer" and "references". Must be called from a thread
+    without a running event loop (e.g. a sync route); async callers should await
+    generate_legal_advice_async instead.
+    """
+    return asyncio.run(generate_legal_advice_async(prompt, document_context))
 
 
 def analyze_document(file_path: str, mime_type: str):
@@ -197,33 +381,109 @@ def analyze_document(file_path: str, mime_type: str):
         return {"error": "Unsupported file type for analysis."}
 
 
-def analyze_labour_contract(document_text: str):
+# Bump when the clause analysis prompt changes so cached analyses are not reused
+CLAUSE_PROMPT_VERSION = "1"
+
+
+def analyze_labour_contract(document_text: str, include_text: bool = False):
     """
     Analyzes a labor contract using a detailed prompt and returns structured JSON.
+
+    The contract is split into clause segments fingerprinted by normalized hash.
+    Segments already analyzed (e.g. on re-submission after an edit) are served
+    from the clause cache, so only new or changed segments are sent to the model.
+    The document text is echoed back as documentText only with include_text.
     """
     if not MODEL_ID:
         raise ValueError("MODEL_ID is not configured.")
 
+    segments = split_clauses(document_text)
+    # Cache keys cover the model and prompt version as well as the clause text
+    hashes = [_cache_key(MODEL_ID, CLAUSE_PROMPT_VERSION, clause_hash(segment)) for segment in segments]
+    cached = {h: clause_cache.get(h) for h in set(hashes)}
+    pending = []
+    seen = set()
+    for index, (segment, h) in enumerate(zip(segments, hashes)):
+        if cached[h] is None and h not in seen:
+            pending.append((index, segment))
+            seen.add(h)
+    logger.info(f"Contract has {len(segments)} clause segments, {len(pending)} new or changed.")
+
+    context_stats = None
+    if pending:
+        analyzed, context_stats = _analyze_clause_segments(pending)
+        if analyzed is None:
+            return {"error": "Failed to parse model output."}
+        for index, segment in pending:
+            clauses = analyzed.get(index, [])
+            if clauses or is_trivial_segment(segment):
+                cached[hashes[index]] = clause_cache.set(hashes[index], clauses)
+            else:
+                # The model skipped a substantive segment; show nothing for it
+                # now but do not cache that, so the next submission retries it
+                logger.warning(f"Model returned no clauses for segment {index}; not caching.")
+                cached[hashes[index]] = []
+
+    merged = []
+    for segment, h in zip(segments, hashes):
+        for clause in cached[h]:
+            # Cache hits match after normalization, so point originalText at
+            # the text as it appears in this document
+            merged.append({**clause, "originalText": verbatim_text(clause.get("originalText"), segment)})
+
+    result = {
+        # Recalculate summary from the merged clauses to ensure data integrity
+        "summary": summarize_clauses(merged),
+        "clauses": merged,
+        # Knowledge base context assembly (chunks and tokens retrieved, used and
+        # saved); None when nothing was sent to the model or retrieval failed
+        "contextStats": context_stats,
+    }
+    if include_text:
+        result["documentText"] = document_text
+    return result
+
+
+def _analyze_clause_segments(pending):
+    """
+    Sends the given (index, segment) pairs to the model and returns a dict of
+    segment index -> list of analyzed clauses (None if the output is unusable),
+    and the knowledge base context stats.
+    """
+    segments = [segment for _, segment in pending]
+
     retrieved_text = ""
+    context_stats = None
     if KNOWLEDGE_BASE_ID:
         logger.info("Attempting to retrieve from knowledge base for document analysis...")
+        # Query with the clause headings; the full contract text dilutes the embedding
+        query = retrieval_query([clause_heading(segment) for segment in segments])
+        if not query:
+            query = "\n\n".join(segments)[:1000]
         try:
             retrieval_response = bedrock_agent_client.retrieve(
                 knowledgeBaseId=KNOWLEDGE_BASE_ID,
-                retrievalQuery={'text': document_text},
+                retrievalQuery={'text': query},
                 retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': 20}} # Increased to 20
             )
             retrieved_chunks = [result['content']['text'] for result in retrieval_response.get('retrievalResults', [])]
             if retrieved_chunks:
-                retrieved_text = "\n\n".join(retrieved_chunks)
                 logger.info(f"Retrieved {len(retrieved_chunks)} chunks from knowledge base.")
+                # Dedupe, rerank against the clauses and pack under the token budget
+                retrieved_text, context_stats = assemble_context(retrieved_chunks, segments)
         except (ClientError, BotoCoreError) as e:
             logger.error(f"Error retrieving from knowledge base: {e}")
 
+    contract_text = "\n".join(
+        f'<clause id="{index}">\n{segment}\n</clause>' for index, segment in pending
+    )
+
     prompt = f'''You are a specialized AI legal assistant for Malaysian labour contracts. Your task is to conduct a detailed analysis of the provided contract text and return a structured JSON output.
 
+The contract text is split into numbered <clause> segments. Analyze every segment. A segment may contain several clauses, or none worth reporting (e.g. a title or signature block).
+
 <contract_text>
-{document_text}
+{contract_text}
 </contract_text>
 
 <knowledge_base_context>
@@ -233,12 +493,9 @@ def analyze_labour_contract(document_text: str):
 Your response MUST be a single, valid JSON object and nothing else, following the structure below.
 
 {{
-  "summary": {{
-    "criticalIssues": <count_of_red_clauses>,
-    "areasForCaution": <count_of_yellow_clauses>
-  }},
   "clauses": [
     {{
+      "segmentId": <the id of the <clause> segment this clause comes from>,
       "title": "<A concise, descriptive title for the clause>",
       "originalText": "<The exact, verbatim text of the clause from the document>",
       "color": "'Red' or 'Yellow' or 'Green'",
@@ -251,7 +508,7 @@ Your response MUST be a single, valid JSON object and nothing else, following th
 '''
     request_payload = {
         "prompt": prompt,
-        "max_gen_len": 8192,
+        "max_gen_len": min(8192, 512 + 1024 * len(pending)),
         "temperature": 0.1
     }
 
@@ -271,27 +528,53 @@ Your response MUST be a single, valid JSON object and nothing else, following th
         if start_index == -1 or end_index == 0:
             raise json.JSONDecodeError("No JSON object found", generated_text, 0)
 
-        json_string = generated_text[start_index:end_index]
-        obj = json.loads(json_string)
-
-        # Recalculate summary to ensure data integrity
-        if 'clauses' in obj and isinstance(obj['clauses'], list):
-            red_count = sum(1 for clause in obj['clauses'] if clause.get('color') == 'Red')
-            yellow_count = sum(1 for clause in obj['clauses'] if clause.get('color') == 'Yellow')
-            obj['summary'] = {
-                'criticalIssues': red_count,
-                'areasForCaution': yellow_count
-            }
-
-        obj['documentText'] = document_text  # Add document text to the response
-        return obj  # Return as a dictionary
+        obj = json.loads(generated_text[start_index:end_index])
     except json.JSONDecodeError:
         logger.error(f"Failed to parse JSON from model output: {generated_text}")
-        return {"error": "Failed to parse model output."}
-
-def analyze_labour_contract_file(file_path: str, mime_type: str):
+        return None, context_stats
+
+    clauses = obj.get('clauses')
+    if not isinstance(clauses, list):
+        logger.error(f"Model output has no clauses list: {generated_text}")
+        return None, context_stats
+
+    analyzed = {index: [] for index, _ in pending}
+    for clause in clauses:
+        if not isinstance(clause, dict):
+            continue
+        segment_id = _match_segment(clause, pending)
+        if segment_id is None:
+            # Caching it under a guessed segment would misplace it in later analyses
+            logger.warning(f"Dropping clause not matching any segment: {clause.get('title')!r}")
+            continue
+        analyzed[segment_id].append(clause)
+    return analyzed, context_stats
+
+
+def _match_segment(clause: dict, pending):
+    """
+    Maps a model-returned clause back to its segment, using segmentId when valid
+    and otherwise the segment containing its originalText. Returns None if
+    neither matches.
+    """
+    valid_ids = [index for index, _ in pending]
+    try:
+        segment_id = int(clause.get('segmentId'))
+        if segment_id in valid_ids:
+            return segment_id
+    except (TypeError, ValueError):
+        pass
+
+    original = normalize_clause(clause.get('originalText') or "")
+    for index, segment in pending:
+        if original and original in normalize_clause(segment):
+            return index
+    return None
+
+def analyze_labour_contract_file(file_path: str, mime_type: str, include_text: bool = False):
     """
-    Analyzes a labor contract from a file.
+    Analyzes a labor contract from a file. With include_text, the extracted
+    text is returned as documentText.
     """
     text = ""
     if mime_type == "application/pdf":
@@ -305,4 +588,4 @@ def analyze_labour_contract_file(file_path: str, mime_type: str):
     else:
         return {"error": f"Unsupported file type: {mime_type}. Please upload a PDF, TXT, or MD file."}
     
-    return analyze_labour_contract(text)
\ No newline at end of file
+    return analyze_labour_contract(text, include_text)
\ No newline at end of file
@@ -3,6 +3,8 @@ import uuid
 import time
 import requests
 import json
+import os
+from server.services.audio import normalize_audio
 
 def transcribe_audio(audio_file_path: str, language: str):
     transcribe = boto3.client('transcribe')
@@ -11,19 +13,29 @@ def transcribe_audio(audio_file_path: str, language: str):
     # Generate unique job name
     job_name = f"transcription-job-{uuid.uuid4()}"
     
+    # Downmix, resample to 16 kHz, trim silence and re-encode to FLAC before upload
+    upload_path, media_format, sample_rate = normalize_audio(audio_file_path)
+
     # Upload audio to a temporary S3 bucket
     bucket_name = "audio-file-temp"
-    audio_object_name = f"{job_name}.wav"
-    s3.upload_file(audio_file_path, bucket_name, audio_object_name)
+    audio_object_name = f"{job_name}.{media_format}"
+    try:
+        s3.upload_file(upload_path, bucket_name, audio_object_name)
+    finally:
+        if upload_path != audio_file_path:
+            os.remove(upload_path)
     job_uri = f"s3://{bucket_name}/{audio_object_name}"
 
     # Start transcription job
-    transcribe.start_transcription_job(
-        TranscriptionJobName=job_name,
-        Media={'MediaFileUri': job_uri},
-        MediaFormat='wav',
-        LanguageCode=language
-    )
+    job_args = {
+        "TranscriptionJobName": job_name,
+        "Media": {'MediaFileUri': job_uri},
+        "MediaFormat": media_format,
+        "LanguageCode": language
+    }
+    if sample_rate:
+        job_args["MediaSampleRateHertz"] = sample_rate
+    transcribe.start_transcription_job(**job_args)
 
     # Poll for job completion
     while True:
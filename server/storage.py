@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, text, bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+import html
+import re
 import uuid
 from datetime import datetime
 
@@ -18,7 +20,7 @@ class ChatSession(Base):
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    sessionId = Column(String, ForeignKey("chat_sessions.id"))
+    sessionId = Column(String, ForeignKey("chat_sessions.id"), index=True)
     role = Column(String)
     content = Column(Text)
     createdAt = Column(String, default=lambda: datetime.utcnow().isoformat())
@@ -38,7 +40,45 @@ class UploadedFile(Base):
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Full-text index over chat_messages.content. It is an external-content FTS5
+# table: it stores only the index, and triggers keep it in sync with the rows.
+CHAT_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        content,
+        content='chat_messages',
+        content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF content ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    # create_all only adds indexes for new tables; existing chat.db files need this
+    'CREATE INDEX IF NOT EXISTS "ix_chat_messages_sessionId" ON chat_messages ("sessionId")',
+]
+
+def migrate_chat_fts(engine):
+    """
+    Creates the chat search index and triggers, backfilling it from existing
+    messages the first time it is created. Safe to run on every startup.
+    """
+    with engine.begin() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages_fts'"
+        ).first()
+        for statement in CHAT_FTS_SCHEMA:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')")
+
 Base.metadata.create_all(bind=engine)
+migrate_chat_fts(engine)
 
 def get_db():
     db = SessionLocal()
@@ -75,3 +115,66 @@ def save_uploaded_file(db, file_data):
     db.commit()
     db.refresh(db_file)
     return db_file
+
+def to_fts_query(query: str):
+    """
+    Turns free text into a safe FTS5 query: every word must match, and the last
+    word also matches as a prefix so results show up while the user is typing.
+    Returns None if the text has no searchable words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+# snippet() marks matches with these control characters; the snippet is then
+# HTML-escaped and only the markers are turned into <mark> tags, so message
+# content can never inject markup
+_MATCH_START, _MATCH_END = "\x02", "\x03"
+
+def _render_snippet(snippet: str) -> str:
+    escaped = html.escape(snippet or "")
+    return escaped.replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
+
+def search_chat_messages(db, query: str, session_ids=None, role: str = None, limit: int = 20, offset: int = 0):
+    """
+    Searches message content, best BM25 match first, with a highlighted snippet.
+    Searches all sessions when session_ids is empty; callers must restrict that
+    to authorized users.
+    """
+    fts_query = to_fts_query(query)
+    if fts_query is None:
+        return {"results": [], "limit": limit, "offset": offset, "hasMore": False}
+
+    filters = ""
+    params = {"query": fts_query, "limit": limit + 1, "offset": offset}
+    bind = []
+    if session_ids:
+        filters += ' AND m."sessionId" IN :session_ids'
+        params["session_ids"] = list(session_ids)
+        bind.append(bindparam("session_ids", expanding=True))
+    if role:
+        filters += " AND m.role = :role"
+        params["role"] = role
+
+    statement = text(f"""
+        SELECT m.id, m."sessionId", m.role, m."createdAt",
+               snippet(chat_messages_fts, 0, :match_start, :match_end, '…', 16) AS snippet,
+               bm25(chat_messages_fts) AS score
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        WHERE chat_messages_fts MATCH :query{filters}
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """).bindparams(*bind)
+    params.update(match_start=_MATCH_START, match_end=_MATCH_END)
+    rows = db.execute(statement, params).mappings().all()
+
+    return {
+        "results": [{**row, "snippet": _render_snippet(row["snippet"])} for row in rows[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "hasMore": len(rows) > limit,
+    }
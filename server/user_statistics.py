@@ -9,19 +9,28 @@ DYNAMODB_TABLE_NAME = 'user_statistics'
 # Initialize DynamoDB Resource
 dynamodb = boto3.resource('dynamodb')
 
-def get_all_statistics():
+def get_all_statistics(attributes=None):
     """
-    Scans the DynamoDB table and returns all items.
+    Scans the DynamoDB table and returns all items, or only the given top-level
+    attributes of each item.
     """
     print(f"\nFetching all data from '{DYNAMODB_TABLE_NAME}'...")
     table = dynamodb.Table(DYNAMODB_TABLE_NAME)
     
     try:
-        response = table.scan()
+        scan_kwargs = {}
+        if attributes:
+            # Placeholders avoid clashes with DynamoDB reserved words
+            names = {f"#a{i}": name for i, name in enumerate(attributes)}
+            scan_kwargs['ProjectionExpression'] = ", ".join(names)
+            scan_kwargs['ExpressionAttributeNames'] = names
+
+        response = table.scan(**scan_kwargs)
         items = response['Items']
         
         while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            response = table.scan(**scan_kwargs)
             items.extend(response['Items'])
             
         return items